@@ -1,17 +1,28 @@
-import threading
-import re
+import os
+import shutil
+import subprocess
+import mmap
 import logging
 import argparse
 import sys
 import concurrent.futures
 
-from typing import List, Optional, TextIO
+from array import array
+
+from typing import BinaryIO, Iterator, List, Optional, Tuple
 
 """
 Author: Olof Magnusson
 Date: 2025-05-22
 A program that searches for rules using the msg header for faster lookups of service names in inventory lists
 """
+MSG_PREFIX = b'msg:"'
+OUTPUT_BUFFER_SIZE = 1 << 20
+# Target size of one unit of work, small enough to stay in a core's L2 cache
+CHUNK_SIZE = 512 * 1024
+# Characters that must be escaped to use the service name literally in a ripgrep pattern
+RIPGREP_META = set('\\.+*?()|[]{}^$')
+
 BANNER = r"""
    _____                 _             __ _           _
   / ____|               (_)           / _(_)         | |
@@ -24,6 +35,55 @@ BANNER = r"""
   @olofmagn(1.0)
 
         """
+
+def _search_chunk(input_file: str, start: int, end: int, service_name_lower: bytes) -> array:
+    """
+    Searches a byte range of the rule file for the service name in the 'msg' field.
+
+    Runs in a worker process, so it maps the input file itself and scans the raw bytes without decoding.
+    The range is case-folded once and scanned for the service name in a single pass; only the lines
+    containing a hit are inspected for a 'msg' field. Matched lines are returned as offsets into the
+    file rather than bytes, which keeps the result cheap to send back to the main process.
+
+    Args:
+    - input_file (str): Path to the input Suricata rule file.
+    - start (int): Offset of the first byte of the range, always at the start of a line.
+    - end (int): Offset just past the last byte of the range, always at the end of a line.
+    - service_name_lower (bytes): The lowercased service name to search for.
+
+    Returns:
+    - array: Flat pairs of start and end offsets of the matched lines.
+    """
+    matched = array('q')
+    append = matched.append
+    msg_prefix = MSG_PREFIX
+    prefix_len = len(msg_prefix)
+
+    with open(input_file, 'rb') as infile, mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        data = mm[start:end].lower()
+        # Bound locally so the hit loop only touches fast locals
+        find = data.find
+        rfind = data.rfind
+        size = len(data)
+
+        hit = find(service_name_lower)
+        while hit != -1:
+            line_start = rfind(b'\n', 0, hit) + 1
+            line_end = find(b'\n', hit)
+            line_end = size if line_end == -1 else line_end + 1
+
+            msg_start = find(msg_prefix, line_start, line_end)
+            if msg_start != -1:
+                msg_start += prefix_len
+                msg_end = find(b'"', msg_start, line_end)
+                if msg_end > msg_start and find(service_name_lower, msg_start, msg_end) != -1:
+                    append(start + line_start)
+                    append(start + line_end)
+
+            hit = find(service_name_lower, line_end)
+
+    return matched
+
 class LoggerManager:
     def __init__(self, name: str = __name__, level: int = logging.INFO):
         self.logger = logging.getLogger(name)
@@ -40,7 +100,7 @@ class LoggerManager:
         return self.logger
 
 class SuricataRuleSearcher:
-    def __init__(self, input_file: str, output_file: Optional[str], service_name: str, num_threads: int = 4):
+    def __init__(self, input_file: str, output_file: Optional[str], service_name: str, num_threads: int = 4, fast: bool = False):
         """
         Initializes the SuricataRuleSearcher object.
 
@@ -48,112 +108,197 @@ class SuricataRuleSearcher:
         - input_file (str): Path to the input Suricata rule file.
         - output_file (str): Path to the output file for saving matched rules.
         - service_name (str): The service name to search for in the 'msg' field.
-        - num_threads (int): The number of threads to use for processing.
+        - num_threads (int): The number of worker processes to use for processing.
+        - fast (bool): Delegate the search to ripgrep when it is installed.
         """
         self.logger = LoggerManager(self.__class__.__name__).get_logger()
         self.input_file = input_file
         self.output_file = output_file
         self.service_name = service_name
         self.num_threads = num_threads
-        self.service_pattern = re.compile(r'msg:"([^"]+)"', re.IGNORECASE)
+        self.fast = fast
+        # Fold the needle exactly like the haystack: bytes.lower only touches ASCII letters
+        self._needle = (service_name or '').encode('utf-8').lower()
 
-    def _load_file(self) -> List[str]:
+    def _load_file(self) -> Optional[mmap.mmap]:
         try:
-            with open(self.input_file, 'r', encoding='utf-8') as infile:
-                lines = infile.readlines()
-            return lines
+            with open(self.input_file, 'rb') as infile:
+                # An empty file cannot be mapped and has nothing to search anyway
+                if not infile.seek(0, 2):
+                    return None
+                return mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
         except FileNotFoundError:
-            self.logger.error(f"File not found: {self.input_file}. Perhaps misspelled? Exiting the program.")
+            self.logger.error("File not found: %s. Perhaps misspelled? Exiting the program.", self.input_file)
             sys.exit(1)
         except IOError:
-            self.logger.error(f"I/O error occured when reading {self.input_file}. Exiting the program")
+            self.logger.error("I/O error occured when reading %s. Exiting the program", self.input_file)
             sys.exit(1)
 
     def _validate_service_name(self) -> bool:
         if not self.service_name:
-            self.logger.error(f"No service name provided: {self.service_name}. Exiting the program")
+            self.logger.error("No service name provided: %s. Exiting the program", self.service_name)
             return False
         return True
 
-    def _search_for_service_in_chunk(self, chunk: List[str]) -> int:
+    def process_file_in_chunks(self) -> None:
         """
-        Searches for the specified service name in a chunk of the Suricata rule file.
-
-        Args:
-        - chunk (list): A chunk of lines to process.
+        Processes the Suricata rule file in chunks and uses worker processes to search for the specific service.
         """
-        # Console or printout to file depending on the arguments provided
-        if not self.output_file:
-            output=self._find_matches(chunk)
-        else:
-            with open(self.output_file, 'a', encoding='utf-8') as outfile:
-                output=self._find_matches(chunk, outfile)
+        if not self._validate_service_name():
+            sys.exit(1)
 
-        return output
+        if self.fast:
+            ripgrep = shutil.which('rg')
+            if ripgrep:
+                self.logger.info("Starting search for service '%s' in file '%s' with ripgrep...", self.service_name, self.input_file)
+                total_matches = self._search_with_ripgrep(ripgrep)
+                self.logger.info("Total matches %d for the service name %s", total_matches, self.service_name)
+                return
+            self.logger.warning("ripgrep (rg) not found in PATH. Falling back to the built-in search")
+
+        self.logger.info("Starting search for service '%s' in file '%s' with %d processes...", self.service_name, self.input_file, self.num_threads)
+
+        mm = self._load_file()
+        total_matches = 0
+        if mm is not None:
+            with mm:
+                total_matches = self._search_mapped_file(mm)
+        elif self.output_file:
+            # Still truncate the output so an empty rule file never leaves stale matches behind
+            open(self.output_file, 'wb').close()
+
+        self.logger.info("Total matches %d for the service name %s", total_matches, self.service_name)
+
+    def _search_with_ripgrep(self, ripgrep: str) -> int:
+        if not os.path.isfile(self.input_file):
+            self.logger.error("File not found: %s. Perhaps misspelled? Exiting the program.", self.input_file)
+            sys.exit(1)
 
-    def _find_matches(self, chunk: List[str], output_file: Optional[TextIO] = None) -> int:
-        if not self.service_name:
-            return 0
+        service_name = ''.join('\\' + char if char in RIPGREP_META else char for char in self.service_name)
+        # (?i-u) folds ASCII letters only, exactly like the bytes.lower folding of the built-in search
+        command = [
+            ripgrep, '--no-config', '--no-filename', '--no-line-number', '--color', 'never',
+            # Search raw bytes like the built-in search: no binary detection and no BOM sniffing
+            '--text', '--encoding', 'none',
+            '--regexp', f'(?i-u)msg:"[^"]*{service_name}[^"]*"', self.input_file
+        ]
+
+        # rg's output is streamed in blocks, so a broad name never holds every matched rule in memory
+        with subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE) as process:
+            if self.output_file:
+                with open(self.output_file, 'wb', buffering=OUTPUT_BUFFER_SIZE) as outfile:
+                    total_matches = self._copy_ripgrep_output(process.stdout, outfile)
+            else:
+                total_matches = self._copy_ripgrep_output(process.stdout, sys.stdout.buffer)
+            errors = process.stderr.read()
 
-        matched_lines = 0
-        service_name_lower = self.service_name.lower()
+        # Exit code 1 only means that nothing matched
+        if process.returncode not in (0, 1):
+            self.logger.error("ripgrep failed: %s. Exiting the program", errors.decode('utf-8', errors='replace').strip())
+            sys.exit(1)
 
-        for line in chunk:
-            match = self.service_pattern.search(line)
-            if not match:
-                continue
+        return total_matches
 
-            msg_content = match.group(1)
-            if not msg_content or service_name_lower not in msg_content.lower():
-                continue
+    def _copy_ripgrep_output(self, source: BinaryIO, outfile: BinaryIO) -> int:
+        total_matches = 0
+        blocks = iter(lambda: source.read(OUTPUT_BUFFER_SIZE), b'')
 
-            matched_lines += 1
+        try:
+            for block in blocks:
+                total_matches += block.count(b'\n')
+                outfile.write(block)
+            outfile.flush()
+        except BrokenPipeError:
+            # Only stdout raises this: the reader went away, so the rest is only counted
+            self._silence_stdout()
+            total_matches += sum(block.count(b'\n') for block in blocks)
+
+        return total_matches
+
+    def _search_mapped_file(self, mm: mmap.mmap) -> int:
+        # Many cache-sized chunks instead of one per process, so idle workers keep picking up work
+        num_chunks = max(self.num_threads * 4, len(mm) // CHUNK_SIZE)
+        chunks = self._split_offsets_evenly(mm, num_chunks)
+        total_matches = 0
+        write_error = None
+
+        with concurrent.futures.ProcessPoolExecutor(max_workers=self.num_threads) as executor:
+            futures = [
+                executor.submit(_search_chunk, self.input_file, start, end, self._needle)
+                for start, end in chunks
+            ]
+            results = self._completed_results(futures)
+
+            # The running total is kept here so that a failure still reports what was written
+            try:
+                # Only the main process touches the output to avoid write contention between workers
+                if self.output_file:
+                    with open(self.output_file, 'wb', buffering=OUTPUT_BUFFER_SIZE) as outfile:
+                        for offsets in results:
+                            self._write_matches(mm, offsets, outfile)
+                            total_matches += len(offsets) // 2
+                else:
+                    total_matches = self._print_matches(mm, results)
+            except OSError as e:
+                write_error = str(e)
+
+        if write_error:
+            self.logger.error("Failed to write matches after %d matches: %s. Exiting the program", total_matches, write_error)
+            sys.exit(1)
 
-            if output_file:
-                output_file.write(line)
-            else:
-                self.logger.info(line.rstrip())
+        return total_matches
 
-        return matched_lines
+    def _completed_results(self, futures: List[concurrent.futures.Future]) -> Iterator[array]:
+        # Results are taken in file order; a failed chunk is logged and skipped so the others are still written
+        for future in futures:
+            try:
+                yield future.result()
+            except Exception as e:
+                self.logger.error("Error in worker process %s", e)
 
-    def process_file_in_chunks(self) -> None:
-        """
-        Processes the Suricata rule file in chunks and uses threading to search for the specific service.
-        """
-        if not self._validate_service_name():
-            sys.exit(1)
+    def _print_matches(self, mm: mmap.mmap, results: Iterator[array]) -> int:
+        total_matches = 0
+        stdout = sys.stdout.buffer
 
-        self.logger.info(f"Starting search for service '{self.service_name}' in file '{self.input_file}' with {self.num_threads} threads...")
-
-        lines = self._load_file()
-        # Make sure the workload is evenly distributed among threads
-        chunks = self._split_lines_evenly(lines, self.num_threads)
-
-        with concurrent.futures.ThreadPoolExecutor(max_workers=self.num_threads) as executor:
-            total_matches = 0 
-            futures = []
-            for chunk in chunks:
-                if chunk:
-                    futures.append(executor.submit(self._search_for_service_in_chunk, chunk))
-
-            for future in concurrent.futures.as_completed(futures):
-                try:
-                    matches = future.result()
-                    total_matches += matches 
-                except Exception as e:
-                    logging.error(f"Error in thread {e}")
-            
-            self.logger.info(f"Total matches {total_matches} for the service name {self.service_name}")
-
-    def _split_lines_evenly(self, lines: List[str], num_chunks: int) -> List[List[str]]:
-        avg = len(lines) // num_chunks
-        remainder = len(lines) % num_chunks
+        # Matched rules bypass the logger so they can be piped as plain rule lines
+        try:
+            for offsets in results:
+                total_matches += len(offsets) // 2
+                self._write_matches(mm, offsets, stdout)
+            stdout.flush()
+        except BrokenPipeError:
+            # The reader went away (e.g. `| head`), which is a normal way to stop, so the rest is only counted
+            self._silence_stdout()
+            total_matches += sum(len(offsets) // 2 for offsets in results)
+
+        return total_matches
+
+    def _silence_stdout(self) -> None:
+        # Point stdout at /dev/null so the interpreter does not fail again when it flushes stdout on exit
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, sys.stdout.fileno())
+        os.close(devnull)
+
+    def _write_matches(self, mm: mmap.mmap, offsets: array, outfile: BinaryIO) -> None:
+        write = outfile.write
+
+        for i in range(0, len(offsets), 2):
+            write(mm[offsets[i]:offsets[i + 1]])
+
+    def _split_offsets_evenly(self, mm: mmap.mmap, num_chunks: int) -> List[Tuple[int, int]]:
+        size = len(mm)
+        avg = size // num_chunks
         chunks = []
         start = 0
 
-        for i in range(num_chunks):
-            end = start + avg + (1 if i < remainder else 0)
-            chunks.append(lines[start:end])
+        for i in range(1, num_chunks + 1):
+            if start >= size:
+                break
+
+            # Snap each boundary forward to the next newline so no line is split between chunks
+            end = mm.find(b'\n', max(start, i * avg - 1)) if i < num_chunks else -1
+            end = size if end == -1 else end + 1
+            chunks.append((start, end))
             start = end
 
         return chunks
@@ -193,7 +338,12 @@ class ArgumentParser:
             '-t', '--threads', 
             type=int,
             default=4,
-            help="Number of threads to use (default: 4)"
+            help="Number of worker processes to use (default: 4)"
+        )
+        parser.add_argument(
+            '--fast',
+            action='store_true',
+            help="Delegate the search to ripgrep (rg) when it is installed, for very large rule files"
         )
 
         return parser
@@ -219,6 +369,7 @@ class SuricataServiceSearchApp:
                 output_file=self.args.output_file,
                 service_name=self.args.service_name,
                 num_threads=self.args.threads,
+                fast=self.args.fast,
                 )
 
     def run(self) -> None:
@@ -238,7 +389,7 @@ def main():
         print("\nOperation cancelled by user")
         sys.exit(1)
     except Exception as e:
-        logging.error(f"Unexpected error: {e}")
+        logging.error("Unexpected error: %s", e)
         sys.exit(1)
 
 if __name__ == '__main__':